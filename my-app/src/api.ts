@@ -36,6 +36,17 @@ export interface ApiMessage {
     hobbies?: string;
   }
   
+  export interface ChatInboxItem {
+    id: number
+    thread_id: string
+    created_at: string
+    avatar: Pick<Avatar, "id" | "name" | "image_url" | "image_status">
+    last_message: string | null
+    last_message_role: "user" | "assistant" | null
+    last_message_at: string | null
+    message_count: number
+  }
+
   export interface UserRead {
     id: number
     username: string
@@ -88,6 +99,26 @@ export interface ApiMessage {
   });
 }
   
+  export interface BulkAvatarItem {
+    index: number
+    status: "created" | "invalid"
+    avatar: Avatar | null
+    error: string | null
+  }
+
+  /** Create many avatars in one request; images are generated in the background */
+  export function createAvatarsBulk(userId: number, dtos: AvatarCreateDTO[]): Promise<{
+    created: number
+    failed: number
+    items: BulkAvatarItem[]
+  }> {
+    return request(`${BASE}/users/${userId}/avatars/bulk/`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(dtos)
+    })
+  }
+
   // ◼️ Chats
   
   /** List all chat‐sessions for a user, remapping avatar_id→characterId */
@@ -102,6 +133,13 @@ export interface ApiMessage {
     )
   }
   
+  /** Inbox: chats with avatar, last message preview and count, newest activity first */
+  export function listInbox(userId: number, limit = 20, offset = 0): Promise<ChatInboxItem[]> {
+    return request<ChatInboxItem[]>(
+      `${BASE}/users/${userId}/inbox/?limit=${limit}&offset=${offset}`
+    )
+  }
+
   /** Start a new chat‐session for this user + avatar */
   export function createChat(
     userId: number,
@@ -132,4 +170,8 @@ export interface ApiMessage {
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({ avatar_id: avatarId, message })
     })
-  }
\ No newline at end of file
+  }
+  /** Stop the assistant reply in flight for this chat (partial reply is kept) */
+  export function cancelReply(chatId: number): Promise<{ cancelled: boolean; turn_id: number | null }> {
+    return request(`${BASE}/api/assistant/${chatId}/cancel/`, { method: "POST" })
+  }
@@ -0,0 +1,136 @@
+# archive.py
+import os
+import json
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import func
+from sqlmodel import Session, select, delete
+
+from models import Message, MessageArchive, MessageRead, CompactionReport
+from tracing import traced
+
+ARCHIVE_MAX_AGE_DAYS = int(os.getenv("ARCHIVE_MAX_AGE_DAYS", "30"))
+ARCHIVE_INACTIVE_DAYS = int(os.getenv("ARCHIVE_INACTIVE_DAYS", "7"))
+ARCHIVE_INTERVAL_SEC = int(os.getenv("ARCHIVE_INTERVAL_SEC", "3600"))
+ARCHIVE_BLOCK_SIZE = int(os.getenv("ARCHIVE_BLOCK_SIZE", "500"))
+
+
+def _encode_block(messages: List[Message]) -> bytes:
+    rows = [[m.id, m.role, m.content, m.created_at.isoformat()] for m in messages]
+    return json.dumps(rows, ensure_ascii=False).encode("utf-8")
+
+
+def _decode_block(block: MessageArchive) -> List[MessageRead]:
+    rows = json.loads(zlib.decompress(block.payload).decode("utf-8"))
+    return [
+        MessageRead(
+            id=mid,
+            chat_id=block.chat_id,
+            role=role,
+            content=content,
+            created_at=datetime.fromisoformat(created_at),
+        )
+        for mid, role, content, created_at in rows
+    ]
+
+
+def _used_bytes(session: Session) -> int:
+    """Bytes of the SQLite file holding data: all pages minus the freelist."""
+    conn = session.connection()
+    page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+    page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+    freelist = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return (page_count - freelist) * page_size
+
+
+@traced("archive.read_archived_messages")
+def read_archived_messages(session: Session, chat_id: int) -> List[MessageRead]:
+    stmt = (
+        select(MessageArchive)
+        .where(MessageArchive.chat_id == chat_id)
+        .order_by(MessageArchive.first_message_id.asc())
+    )
+    out: List[MessageRead] = []
+    for block in session.exec(stmt).all():
+        out.extend(_decode_block(block))
+    return out
+
+
+@traced("archive.compact_messages")
+def compact_messages(
+        session: Session,
+        max_age_days: int = ARCHIVE_MAX_AGE_DAYS,
+        inactive_days: int = ARCHIVE_INACTIVE_DAYS,
+) -> CompactionReport:
+    """
+    Move cold messages from the hot `message` table into compressed per-chat
+    blocks. A message is cold if it is older than `max_age_days`, or if its
+    chat has had no activity for `inactive_days`.
+
+    The latest message of every chat always stays hot, so inbox previews
+    never have to decompress a block. Each chat is compacted in its own
+    transaction. `reclaimed_bytes` is measured from SQLite page counts, so it
+    includes row and index overhead and the space taken by the new blocks.
+    """
+    started = time.perf_counter()
+    used_before = _used_bytes(session)
+    now = datetime.utcnow()
+    age_cutoff = now - timedelta(days=max_age_days)
+    inactive_cutoff = now - timedelta(days=inactive_days)
+
+    per_chat = (
+        select(
+            Message.chat_id,
+            func.max(Message.id),
+            func.max(Message.created_at),
+            func.min(Message.created_at),
+            func.count(Message.id),
+        )
+        .group_by(Message.chat_id)
+        .having(func.count(Message.id) > 1)
+    )
+
+    chats = archived = raw_total = stored_total = 0
+    for chat_id, last_id, last_at, first_at, _ in session.exec(per_chat).all():
+        inactive = last_at < inactive_cutoff
+        if not inactive and first_at >= age_cutoff:
+            continue
+
+        stmt = select(Message).where(Message.chat_id == chat_id, Message.id < last_id)
+        if not inactive:
+            stmt = stmt.where(Message.created_at < age_cutoff)
+        cold = session.exec(stmt.order_by(Message.id.asc())).all()
+        if not cold:
+            continue
+
+        for i in range(0, len(cold), ARCHIVE_BLOCK_SIZE):
+            chunk = cold[i:i + ARCHIVE_BLOCK_SIZE]
+            raw = _encode_block(chunk)
+            payload = zlib.compress(raw, 6)
+            session.add(MessageArchive(
+                chat_id=chat_id,
+                first_message_id=chunk[0].id,
+                last_message_id=chunk[-1].id,
+                message_count=len(chunk),
+                payload=payload,
+                raw_size=len(raw),
+            ))
+            raw_total += len(raw)
+            stored_total += len(payload)
+
+        session.exec(delete(Message).where(Message.id.in_([m.id for m in cold])))
+        session.commit()
+        chats += 1
+        archived += len(cold)
+
+    return CompactionReport(
+        chats_compacted=chats,
+        messages_archived=archived,
+        raw_bytes=raw_total,
+        stored_bytes=stored_total,
+        reclaimed_bytes=used_before - _used_bytes(session),
+        elapsed_sec=round(time.perf_counter() - started, 3),
+    )
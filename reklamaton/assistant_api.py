@@ -1,7 +1,9 @@
 import os, time
 from openai import OpenAI
 from models import Avatar
-from typing import Iterator
+from lookup_cache import AvatarRef
+from tracing import span, start_span
+from typing import Callable, Iterator, Optional
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
@@ -12,40 +14,54 @@ def _ensure_assistant() -> str:
     global ASSISTANT_ID
     if ASSISTANT_ID:
         return ASSISTANT_ID
-    assistant = client.beta.assistants.create(
-        name="AI Character Avatar",
-        instructions="Generic container; avatar prompt is added per thread.",
-        model="gpt-4o",
-    )
+    with span("openai.assistants.create"):
+        assistant = client.beta.assistants.create(
+            name="AI Character Avatar",
+            instructions="Generic container; avatar prompt is added per thread.",
+            model="gpt-4o",
+        )
     ASSISTANT_ID = assistant.id
     return ASSISTANT_ID
 
 
-def assistant_chat_sync(thread_id: str, avatar: Avatar, user_msg: str) -> str:
+def assistant_chat_sync(thread_id: str, avatar: AvatarRef, user_msg: str) -> str:
     assistant_id = _ensure_assistant()
-    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_msg)
-    run = client.beta.threads.runs.create(
-        thread_id=thread_id,
-        assistant_id=assistant_id,
-        instructions=avatar.prompt,
-    )
+    with span("openai.messages.create"):
+        client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_msg)
+    with span("openai.runs.create"):
+        run = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            instructions=avatar.prompt,
+        )
+    polls = 0
     while run.status not in {"completed", "failed"}:
         time.sleep(0.4)
-        run = client.beta.threads.runs.retrieve(run.id, thread_id=thread_id)
+        polls += 1
+        with span("openai.runs.retrieve", attempt=polls):
+            run = client.beta.threads.runs.retrieve(run.id, thread_id=thread_id)
     if run.status == "failed":
         raise RuntimeError(run.last_error)
-    msgs = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
+    with span("openai.messages.list"):
+        msgs = client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
     return msgs.data[0].content[0].text.value.strip()
 
 
-def assistant_chat_stream(thread_id: str, avatar: Avatar, user_msg: str) -> Iterator[str]:
+def assistant_chat_stream(
+        thread_id: str,
+        avatar: AvatarRef,
+        user_msg: str,
+        on_run: Optional[Callable[[str], None]] = None,
+) -> Iterator[str]:
     """
     Stream the assistant's reply token-by-token for a given OpenAI thread.
 
     Args:
         thread_id: Existing OpenAI Thread ID (one per ChatSession row).
-        avatar:    Avatar instance whose `prompt` supplies the system instructions.
+        avatar:    AvatarRef (cached id + prompt) whose `prompt` supplies the system instructions.
         user_msg:  The latest user message content.
+        on_run:    Optional callback receiving the run ID once the run is created
+                   (lets the caller cancel it with `cancel_run`).
 
     Yields:
         Incremental text chunks (tokens / fragments) from the assistant response.
@@ -53,33 +69,46 @@ def assistant_chat_stream(thread_id: str, avatar: Avatar, user_msg: str) -> Iter
     assistant_id = _ensure_assistant()
 
     # 1. Append the user's new message to the thread
-    client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=user_msg,
-    )
+    with span("openai.messages.create"):
+        client.beta.threads.messages.create(
+            thread_id=thread_id,
+            role="user",
+            content=user_msg,
+        )
 
     # 2. Kick off a streaming run with the avatar's prompt as instructions
-    stream = client.beta.threads.runs.create(
-        thread_id=thread_id,
-        assistant_id=assistant_id,
-        stream=True,
-        instructions=SYSTEM_TMPL.format(prompt=avatar.prompt),
-    )
+    with span("openai.runs.create", stream=True):
+        stream = client.beta.threads.runs.create(
+            thread_id=thread_id,
+            assistant_id=assistant_id,
+            stream=True,
+            instructions=SYSTEM_TMPL.format(prompt=avatar.prompt),
+        )
 
     # 3. Iterate over streaming events
+    # (spans across yields must not become current: the consumer may resume us in another context)
+    stream_span = start_span("openai.runs.stream")
+    deltas = 0
     try:
         for event in stream:
             etype = getattr(event, "event", None)
 
+            if etype == "thread.run.created":
+                stream_span.set(run_id=event.data.id)
+                if on_run:
+                    on_run(event.data.id)
+
             # Incremental text deltas
-            if etype == "thread.message.delta":
+            elif etype == "thread.message.delta":
                 # Guard against empty / non-text deltas
                 try:
                     parts = event.data.delta.content
                     if parts and parts[0].type == "output_text":
                         delta = parts[0].text.value
                         if delta:
+                            if not deltas:
+                                stream_span.set(first_token_ms=stream_span.elapsed_ms())
+                            deltas += 1
                             yield delta
                 except Exception:
                     # Silently skip malformed delta events
@@ -106,16 +135,25 @@ def assistant_chat_stream(thread_id: str, avatar: Avatar, user_msg: str) -> Iter
             elif etype == "thread.run.failed":
                 err = getattr(event.data, "last_error", None)
                 msg = getattr(err, "message", "Run failed")
+                stream_span.error = msg
                 raise RuntimeError(f"Assistant run failed: {msg}")
 
-            # Completed run (no more deltas expected)
-            elif etype == "thread.run.completed":
+            # Completed or cancelled run (no more deltas expected)
+            elif etype in {"thread.run.completed", "thread.run.cancelled"}:
                 break
 
     finally:
-        # (Optional) any cleanup if needed
-        pass
+        # release the HTTP stream if the caller stops early
+        stream.close()
+        stream_span.set(deltas=deltas)
+        stream_span.end()
+
+
+def cancel_run(thread_id: str, run_id: str) -> None:
+    with span("openai.runs.cancel"):
+        client.beta.threads.runs.cancel(run_id, thread_id=thread_id)
 
 
 def create_new_thread(avatar: Avatar) -> str:
-    return client.beta.threads.create().id
+    with span("openai.threads.create"):
+        return client.beta.threads.create().id
@@ -8,6 +8,13 @@ def init_db():
     SQLModel.metadata.create_all(engine)
 
 
+def ensure_indexes(engine):
+    """create_all skips existing tables, so add indexes declared after a table was created."""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
 def get_session():
     with Session(engine) as session:
         yield session
@@ -4,6 +4,9 @@ import time
 import requests
 import base64
 
+from tracing import span
+from static_files import hashed_filename
+
 class FusionBrainAPI:
     def __init__(self, url, api_key, secret_key):
         self.URL = url
@@ -13,8 +16,9 @@ class FusionBrainAPI:
         }
 
     def get_pipeline(self):
-        r = requests.get(self.URL + 'key/api/v1/pipelines', headers=self.AUTH_HEADERS)
-        r.raise_for_status()
+        with span("fusion.get_pipeline"):
+            r = requests.get(self.URL + 'key/api/v1/pipelines', headers=self.AUTH_HEADERS)
+            r.raise_for_status()
         data = r.json()
         return data[0]['id']
 
@@ -33,30 +37,42 @@ class FusionBrainAPI:
             'pipeline_id': (None, pipeline_id),
             'params':      (None, json.dumps(params), 'application/json'),
         }
-        r = requests.post(self.URL + 'key/api/v1/pipeline/run',
-                          headers=self.AUTH_HEADERS, files=files)
-        r.raise_for_status()
+        with span("fusion.generate"):
+            r = requests.post(self.URL + 'key/api/v1/pipeline/run',
+                              headers=self.AUTH_HEADERS, files=files)
+            r.raise_for_status()
         return r.json()['uuid']
 
     def check_generation(self, request_id, attempts=10, delay=5):
-        for _ in range(attempts):
-            r = requests.get(self.URL + f'key/api/v1/pipeline/status/{request_id}',
-                             headers=self.AUTH_HEADERS)
-            r.raise_for_status()
-            data = r.json()
-            if data['status'] == 'DONE':
-                return data['result']['files']
-            time.sleep(delay)
+        with span("fusion.check_generation", request_id=request_id) as check:
+            for attempt in range(1, attempts + 1):
+                with span("fusion.status", attempt=attempt):
+                    r = requests.get(self.URL + f'key/api/v1/pipeline/status/{request_id}',
+                                     headers=self.AUTH_HEADERS)
+                    r.raise_for_status()
+                    data = r.json()
+                if data['status'] == 'DONE':
+                    check.set(attempts=attempt)
+                    return data['result']['files']
+                time.sleep(delay)
+            check.set(attempts=attempts, timed_out=True)
         return None
 
     def save_images(self, files, out_path_prefix):
-        """Save all returned files under out_path_prefix_1.png, _2.png, …"""
-        for i, fdata in enumerate(files, start=1):
-            if fdata.startswith('http'):
-                img = requests.get(fdata).content
-            else:
-                img = base64.b64decode(fdata)
-            dst = f"{out_path_prefix}_{i}.png"
-            with open(dst, 'wb') as fd:
-                fd.write(img)
-        return True
+        """
+        Save all returned files as out_path_prefix_1.<digest>.png, _2.<digest>.png, …
+        (digest = content hash, so a regenerated image gets a new URL).
+        Returns the saved paths.
+        """
+        paths = []
+        with span("fusion.save_images", count=len(files)):
+            for i, fdata in enumerate(files, start=1):
+                if fdata.startswith('http'):
+                    img = requests.get(fdata).content
+                else:
+                    img = base64.b64decode(fdata)
+                dst = hashed_filename(f"{out_path_prefix}_{i}", img)
+                with open(dst, 'wb') as fd:
+                    fd.write(img)
+                paths.append(dst)
+        return paths
@@ -0,0 +1,153 @@
+# lookup_cache.py
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, NamedTuple, Optional, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession, object_session
+from sqlmodel import Session
+
+from models import Avatar, ChatSession
+
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "10000"))
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class ChatRef(NamedTuple):
+    id: int
+    thread_id: str
+    avatar_id: int
+    user_id: int
+
+
+class AvatarRef(NamedTuple):
+    """Cached avatar fields the assistant calls need (see assistant_api.py)."""
+    id: int
+    prompt: str
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Thread-safe bounded LRU map with hit/miss/eviction counters.
+
+    `load()` runs outside the lock, so an invalidation can land while it is
+    reading the old row. Each key has a generation bumped by `invalidate()`
+    (and all of them by `clear()`); a loaded value is only stored if the
+    generation it was loaded under is still current.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._gen: Dict[K, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get_or_load(self, key: K, load: Callable[[], Optional[V]]) -> Optional[V]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            gen = (self._epoch, self._gen.get(key, 0))
+        value = load()
+        if value is None:
+            return None  # don't cache misses: the row may be created later
+        with self._lock:
+            if gen != (self._epoch, self._gen.get(key, 0)):
+                return value  # invalidated while loading: may be stale, don't cache
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key: K):
+        with self._lock:
+            self._data.pop(key, None)
+            self._gen[key] = self._gen.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._gen.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_chats: LRUCache[int, ChatRef] = LRUCache(LOOKUP_CACHE_SIZE)
+_avatars: LRUCache[int, AvatarRef] = LRUCache(LOOKUP_CACHE_SIZE)
+
+
+def resolve_chat(session: Session, chat_id: int) -> Optional[ChatRef]:
+    def load():
+        chat = session.get(ChatSession, chat_id)
+        return ChatRef(chat.id, chat.thread_id, chat.avatar_id, chat.user_id) if chat else None
+    return _chats.get_or_load(chat_id, load)
+
+
+def resolve_avatar(session: Session, avatar_id: int) -> Optional[AvatarRef]:
+    def load():
+        av = session.get(Avatar, avatar_id)
+        return AvatarRef(av.id, av.prompt) if av else None
+    return _avatars.get_or_load(avatar_id, load)
+
+
+def cache_stats() -> dict:
+    return {"chats": _chats.stats(), "avatars": _avatars.stats()}
+
+
+# Invalidation: ORM updates/deletes of Avatar / ChatSession rows are recorded on
+# their session at flush and evicted only after the commit. Evicting at flush
+# would let a concurrent resolve re-cache the old, still committed row.
+_STALE_KEY = "lookup_cache_stale"
+_CACHES = {"chat": _chats, "avatar": _avatars}
+
+
+def _mark_stale(kind: str, target):
+    session = object_session(target)
+    if session is None:
+        _CACHES[kind].invalidate(target.id)
+        return
+    session.info.setdefault(_STALE_KEY, set()).add((kind, target.id))
+
+
+@event.listens_for(Avatar, "after_update")
+@event.listens_for(Avatar, "after_delete")
+def _avatar_changed(mapper, connection, target):
+    _mark_stale("avatar", target)
+
+
+@event.listens_for(ChatSession, "after_update")
+@event.listens_for(ChatSession, "after_delete")
+def _chat_changed(mapper, connection, target):
+    _mark_stale("chat", target)
+
+
+@event.listens_for(SASession, "after_commit")
+def _evict_committed(session):
+    for kind, key in session.info.pop(_STALE_KEY, ()):
+        _CACHES[kind].invalidate(key)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _forget_rolled_back(session):
+    # the committed rows did not change, so the cached values are still valid
+    session.info.pop(_STALE_KEY, None)
@@ -1,30 +1,41 @@
 # main.py (relevant parts)
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, status, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from sqlmodel import create_engine, SQLModel, Session, select
 from sqlalchemy import or_
 
-from fastapi.staticfiles import StaticFiles
 import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 from seed import seed_system_avatars
 
-from database import get_session, DATABASE_URL, engine
+import database
+from database import get_session, ensure_indexes, DATABASE_URL, engine
 from models import (
     UserCreate, UserRead, User,
-    AvatarCreate, AvatarRead, Avatar,
-    ChatRequest, ChatResponse, ChatSession,
-    MessageRead, Message
+    AvatarCreate, AvatarRead, Avatar, BulkAvatarItem, BulkAvatarResponse,
+    ChatRequest, ChatResponse, CancelResponse, ChatSession, ChatInboxItem,
+    MessageRead, CompactionReport
 )
-from store import create_chat_session, get_chat_session, add_message
-from assistant_api import create_new_thread, assistant_chat_sync, assistant_chat_stream
+from store import create_chat_session, get_chat_session, add_message, list_chat_inbox, list_chat_messages
+from archive import compact_messages, ARCHIVE_INTERVAL_SEC
+from assistant_api import create_new_thread, assistant_chat_sync
+from streams import start_reply, get_reply_stream, cancel_reply
 
 from prompter import build_avatar_prompt, build_image_prompt
 
 from image_gen import FusionBrainAPI
 
+from tracing import span, instrument_engine, start_exporter
+from static_files import HashedStaticFiles, HASHED_NAME, hashed_filename
+from lookup_cache import resolve_chat, resolve_avatar, cache_stats
+
 os.makedirs("static/avatars", exist_ok=True)
 
 app = FastAPI()
@@ -36,12 +47,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 engine = create_engine(DATABASE_URL, echo=True)
+instrument_engine(engine)
+instrument_engine(database.engine)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with span("http.request", method=request.method, path=request.url.path) as req_span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        req_span.set(route=getattr(route, "path", None), status=response.status_code)
+        return response
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+app.mount("/static", HashedStaticFiles(directory="static"), name="static")
 
 FUSION_BASE = os.getenv("FUSION_BASE", "https://api-key.fusionbrain.ai/")
 FUSION_KEY = os.getenv("FUSION_API_KEY")
 FUSION_SECRET = os.getenv("FUSION_SECRET_KEY")
+# Max simultaneous FusionBrain generations, shared by all avatar endpoints
+FUSION_CONCURRENCY = int(os.getenv("FUSION_CONCURRENCY", "2"))
+BULK_AVATARS_MAX = int(os.getenv("BULK_AVATARS_MAX", "100"))
+
+# Image jobs run here, not in Starlette's threadpool: queued jobs wait in the
+# pool's queue instead of holding the workers that serve sync endpoints.
+fusion_pool = ThreadPoolExecutor(max_workers=FUSION_CONCURRENCY, thread_name_prefix="fusion")
 
 client_fusion = FusionBrainAPI(FUSION_BASE, FUSION_KEY, FUSION_SECRET)
 pipeline_id    = client_fusion.get_pipeline()
@@ -51,20 +81,33 @@ from fastapi import BackgroundTasks
 
 def generate_avatar_image_async(avatar_id: int, image_prompt: str):
     """Background: generate + save + update DB."""
+    with span("avatar.generate_image", avatar_id=avatar_id):
+        _generate_avatar_image(avatar_id, image_prompt)
+
+
+def _generate_avatar_image(avatar_id: int, image_prompt: str):
     out_prefix = f"static/avatars/avatar_{avatar_id}"
     try:
         uuid    = fusion_client.generate(image_prompt, pipeline_id)
         files   = fusion_client.check_generation(uuid)
         if not files:
             raise RuntimeError("No files returned")
-        fusion_client.save_images(files, out_prefix)
+        saved = fusion_client.save_images(files, out_prefix)
         # update DB record
+        image_url = "/" + saved[0]
         with Session(engine) as s:
             av = s.get(Avatar, avatar_id)
-            av.image_url    = f"/static/avatars/avatar_{avatar_id}_1.png"
+            previous = av.image_url
+            av.image_url    = image_url
             av.image_status = "ready"
             s.add(av)
             s.commit()
+        # a regenerated image lives under a new name; drop the superseded file
+        if previous and previous != image_url and HASHED_NAME.search(previous):
+            try:
+                os.remove(previous.lstrip("/"))
+            except OSError:
+                pass
     except Exception as e:
         with Session(engine) as s:
             av = s.get(Avatar, avatar_id)
@@ -95,11 +138,60 @@ def queue_system_avatar_generation():
         ...
 
 
+def hash_legacy_avatar_images():
+    """
+    One-time migration: give ready avatar images saved before content hashing
+    (`avatar_N_1.png`) a hashed name so they are served as immutable too.
+    Idempotent: already hashed URLs and missing files are skipped.
+    """
+    superseded = []
+    with Session(engine) as s:
+        ready = s.exec(
+            select(Avatar).where(Avatar.image_status == "ready", Avatar.image_url != None)
+        ).all()
+        for av in ready:
+            path = av.image_url.lstrip("/")
+            if HASHED_NAME.search(path) or not os.path.isfile(path):
+                continue
+            with open(path, "rb") as fd:
+                data = fd.read()
+            root, ext = os.path.splitext(path)
+            dst = hashed_filename(root, data, ext.lstrip(".") or "png")
+            # copy, commit, then delete: a crash never leaves a URL without its file
+            with open(dst, "wb") as fd:
+                fd.write(data)
+            av.image_url = "/" + dst
+            s.add(av)
+            superseded.append(path)
+        s.commit()
+    for path in superseded:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if superseded:
+        print(f"[INIT] hashed {len(superseded)} legacy avatar images")
+
+
+def archive_compaction_loop():
+    """Background: periodically move cold messages into the archive tier."""
+    while True:
+        time.sleep(ARCHIVE_INTERVAL_SEC)
+        try:
+            with Session(engine) as s:
+                report = compact_messages(s)
+            print("[ARCHIVE]", report.model_dump())
+        except Exception as e:
+            print("Message compaction failed:", e)
+
+
 @app.on_event("startup")
 def on_startup():
     SQLModel.metadata.create_all(engine)
+    ensure_indexes(engine)
     with Session(engine) as session:
         seed_system_avatars(session)
+    hash_legacy_avatar_images()
     global fusion_client
     # Инициализируем только если ключи заданы
     if FUSION_KEY and FUSION_SECRET:
@@ -108,6 +200,8 @@ def on_startup():
     else:
         print("FusionBrain keys not set — image generation disabled")
     queue_system_avatar_generation()
+    start_exporter()
+    threading.Thread(target=archive_compaction_loop, daemon=True).start()
 
 
 # ---------- Users ----------
@@ -135,21 +229,14 @@ def read_user(user_id: int, session: Session = Depends(get_session)):
 
 
 # ---------- Avatars ----------
-@app.post("/users/{user_id}/avatars/", response_model=AvatarRead, status_code=201)
-def create_avatar(
-        user_id: int,
-        avatar_in: AvatarCreate,
-        background: BackgroundTasks,
-        session: Session = Depends(get_session)
-):
-    user = session.get(User, user_id)
-    if not user:
-        raise HTTPException(404, "User not found")
+AVATAR_REQUIRED_FIELDS = ("personality", "features", "age", "gender", "hobbies")
+
 
+def build_avatar(user_id: int, avatar_in: AvatarCreate) -> Avatar:
     # Текстовый prompt (личность)
     persona_prompt = build_avatar_prompt(avatar_in)
     image_prompt = build_image_prompt(avatar_in)
-    avatar = Avatar(
+    return Avatar(
         name=avatar_in.name,
         personality=avatar_in.personality,
         features=avatar_in.features,
@@ -162,15 +249,69 @@ def create_avatar(
         image_status="pending",
         image_url=None
     )
+
+
+@app.post("/users/{user_id}/avatars/", response_model=AvatarRead, status_code=201)
+def create_avatar(
+        user_id: int,
+        avatar_in: AvatarCreate,
+        session: Session = Depends(get_session)
+):
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+
+    avatar = build_avatar(user_id, avatar_in)
     session.add(avatar)
     session.commit()
     session.refresh(avatar)
 
     # **this** launches your working code in background:
-    background.add_task(generate_avatar_image_async, avatar.id, image_prompt)
+    fusion_pool.submit(generate_avatar_image_async, avatar.id, avatar.image_prompt)
     return avatar
 
 
+@app.post("/users/{user_id}/avatars/bulk/", response_model=BulkAvatarResponse, status_code=201)
+def create_avatars_bulk(
+        user_id: int,
+        avatars_in: list[dict],
+        session: Session = Depends(get_session)
+):
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+    if len(avatars_in) > BULK_AVATARS_MAX:
+        raise HTTPException(413, f"At most {BULK_AVATARS_MAX} avatars per request")
+
+    items: list[BulkAvatarItem] = []
+    created: list[tuple[int, Avatar]] = []
+    for index, raw in enumerate(avatars_in):
+        # validated per item, so one malformed entry doesn't 422 the whole batch
+        try:
+            avatar_in = AvatarCreate.model_validate(raw)
+            missing = [f for f in AVATAR_REQUIRED_FIELDS if getattr(avatar_in, f) is None]
+            if missing:
+                raise ValueError(f"Missing fields: {', '.join(missing)}")
+        except ValueError as e:  # includes pydantic.ValidationError
+            items.append(BulkAvatarItem(index=index, status="invalid", error=str(e)))
+            continue
+        avatar = build_avatar(user_id, avatar_in)
+        session.add(avatar)
+        created.append((index, avatar))
+
+    # one transaction for the whole batch; flush assigns ids before commit
+    session.flush()
+    for index, avatar in created:
+        items.append(BulkAvatarItem(index=index, status="created", avatar=AvatarRead.model_validate(avatar)))
+    jobs = [(avatar.id, avatar.image_prompt) for _, avatar in created]
+    session.commit()
+
+    for avatar_id, image_prompt in jobs:
+        fusion_pool.submit(generate_avatar_image_async, avatar_id, image_prompt)
+    items.sort(key=lambda item: item.index)
+    return BulkAvatarResponse(created=len(jobs), failed=len(items) - len(jobs), items=items)
+
+
 @app.get("/users/{user_id}/avatars/", response_model=list[AvatarRead])
 def list_avatars(user_id: int, session: Session = Depends(get_session)):
     stmt = select(Avatar).where(
@@ -206,26 +347,58 @@ def list_chats(user_id: int, session: Session = Depends(get_session)):
     return session.exec(stmt).all()
 
 
+@app.get("/users/{user_id}/inbox/", response_model=list[ChatInboxItem])
+def chat_inbox(
+        user_id: int,
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0),
+        session: Session = Depends(get_session)
+):
+    user = session.get(User, user_id)
+    if not user:
+        raise HTTPException(404, "User not found")
+    return list_chat_inbox(session, user_id, limit=limit, offset=offset)
+
+
 # ---------- Messages ----------
 @app.get("/chats/{chat_id}/messages/", response_model=list[MessageRead])
 def list_messages(chat_id: int, session: Session = Depends(get_session)):
     chat = get_chat_session(chat_id, session)
     if not chat:
         raise HTTPException(404, "Chat not found")
-    stmt = select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at.asc())
-    return session.exec(stmt).all()
+    return list_chat_messages(session, chat_id)
+
+
+@app.get("/admin/cache/stats/")
+def lookup_cache_stats():
+    return cache_stats()
+
+
+@app.post("/admin/archive/compact/", response_model=CompactionReport)
+def compact_archive(
+        max_age_days: int | None = Query(None, ge=0),
+        inactive_days: int | None = Query(None, ge=0),
+        session: Session = Depends(get_session)
+):
+    kwargs = {}
+    if max_age_days is not None:
+        kwargs["max_age_days"] = max_age_days
+    if inactive_days is not None:
+        kwargs["inactive_days"] = inactive_days
+    return compact_messages(session, **kwargs)
 
 
 # ---------- Assistant ----------
 @app.post("/api/assistant/{chat_id}/", response_model=ChatResponse)
 def assistant_send(chat_id: int, req: ChatRequest, session: Session = Depends(get_session)):
-    chat = get_chat_session(chat_id, session)
+    # cached: usually no DB round-trip before the provider call
+    chat = resolve_chat(session, chat_id)
     if not chat:
         raise HTTPException(404, "Chat not found")
     if chat.avatar_id != req.avatar_id:
         raise HTTPException(400, "Avatar mismatch for this chat")
 
-    avatar = session.get(Avatar, chat.avatar_id)
+    avatar = resolve_avatar(session, chat.avatar_id)
     if not avatar:
         raise HTTPException(404, "Avatar not found")
 
@@ -241,29 +414,117 @@ def assistant_send(chat_id: int, req: ChatRequest, session: Session = Depends(ge
     return ChatResponse(reply=reply_text)
 
 
+@app.post("/api/assistant/{chat_id}/cancel/", response_model=CancelResponse)
+async def assistant_cancel(chat_id: int, turn_id: int | None = None, session: Session = Depends(get_session)):
+    chat = get_chat_session(chat_id, session)
+    if not chat:
+        raise HTTPException(404, "Chat not found")
+    stream = get_reply_stream(chat.id, turn_id)
+    if not stream:
+        return CancelResponse(cancelled=False)
+    cancelled = await cancel_reply(stream)
+    return CancelResponse(cancelled=cancelled, turn_id=stream.turn_id)
+
+
+def _is_cancel_frame(frame: str) -> bool:
+    if not frame.startswith("{"):
+        return False
+    try:
+        return json.loads(frame).get("type") == "cancel"
+    except (ValueError, AttributeError):
+        return False
+
+
+async def _relay(ws: WebSocket, stream, offset: int = 0):
+    try:
+        async for tok in stream.follow(offset):
+            await ws.send_text(tok)
+    except WebSocketDisconnect:
+        pass
+    except RuntimeError as e:
+        print("Assistant reply failed:", e)
+
+
+async def _ws_turn(ws: WebSocket, session: Session, chat, avatar, user_msg: str, prev_turn,
+                   conn: dict, cancels_seen: int):
+    """
+    One websocket turn: wait for the previous one, start the reply, relay it.
+    A turn still queued when the client sends a cancel is dropped; `cancels_seen`
+    is the connection's cancel count when its frame was read.
+    """
+    if prev_turn:
+        # a failed previous turn must not block this one; cancellation still propagates
+        await asyncio.gather(prev_turn, return_exceptions=True)
+    # one run per OpenAI thread at a time. Other sockets on this chat may be
+    # waiting too, so re-check after every wake-up; nothing below awaits
+    # before start_reply registers the new stream as the chat's latest.
+    while (prev := get_reply_stream(chat.id)) and not prev.done:
+        await prev.wait_done()
+    if conn["cancels"] != cancels_seen:
+        return
+    with span("ws.turn", chat_id=chat.id):
+        turn = add_message(session, chat.id, "user", user_msg)
+        stream = start_reply(chat.id, turn.id, chat.thread_id, avatar, user_msg)
+    await _relay(ws, stream)
+
+
 @app.websocket("/ws/assistant/{chat_id}")
 async def assistant_ws(ws: WebSocket, chat_id: int):
+    """
+    Plain-text protocol: each client frame is a user message, the reply is
+    streamed back as text frames. Generation runs server-side (see streams.py),
+    so a client that reconnects with `?resume=1&offset=N` gets the rest of the
+    chat's in-flight or recently finished reply starting at token N
+    (N = number of frames already received for that reply).
+
+    The control frame `{"type": "cancel"}` stops the reply in flight and drops
+    messages still queued behind it.
+    """
     await ws.accept()
     session = next(get_session())
+    turn_task = None
+    conn = {"cancels": 0}  # bumped by every cancel frame; queued turns compare it
+    cancels = set()        # in-flight cancel_reply tasks (kept referenced)
     try:
-        chat = get_chat_session(chat_id, session)
+        chat = resolve_chat(session, chat_id)
         if not chat:
             await ws.close(code=4404)
             return
         avatar_id = int(ws.query_params.get("avatar_id", chat.avatar_id))
-        avatar = session.get(Avatar, avatar_id)
+        avatar = resolve_avatar(session, avatar_id)
         if not avatar:
             await ws.close(code=4404)
             return
 
+        if ws.query_params.get("resume"):
+            offset = ws.query_params.get("offset", "0")
+            if not offset.isdigit():
+                await ws.close(code=4400)
+                return
+            stream = get_reply_stream(chat.id)
+            if stream:
+                turn_task = asyncio.create_task(_relay(ws, stream, int(offset)))
+
+        # turns run in tasks chained one after another, so frames (a cancel in
+        # particular) keep being read while a reply streams or a message waits
         while True:
-            user_msg = await ws.receive_text()
-            add_message(session, chat.id, "user", user_msg)
-            buf = []
-            for tok in assistant_chat_stream(chat.thread_id, avatar, user_msg):
-                buf.append(tok)
-                await ws.send_text(tok)
-            full_reply = "".join(buf)
-            add_message(session, chat.id, "assistant", full_reply)
+            frame = await ws.receive_text()
+            if _is_cancel_frame(frame):
+                conn["cancels"] += 1
+                current = get_reply_stream(chat.id)
+                if current:
+                    # cancel_reply waits for the provider run to end; don't block reads on it
+                    task = asyncio.create_task(cancel_reply(current))
+                    cancels.add(task)
+                    task.add_done_callback(cancels.discard)
+                continue
+            turn_task = asyncio.create_task(
+                _ws_turn(ws, session, chat, avatar, frame, turn_task, conn, conn["cancels"])
+            )
     except WebSocketDisconnect:
         pass
+    finally:
+        # a reply already started keeps generating; this client's relay and
+        # any messages still queued behind it are dropped
+        if turn_task:
+            turn_task.cancel()
@@ -3,6 +3,7 @@ from datetime import datetime
 from typing import Optional, List
 
 from pydantic import BaseModel
+from sqlalchemy import Column, LargeBinary
 from sqlmodel import SQLModel, Field, Relationship
 
 
@@ -47,6 +48,19 @@ class AvatarRead(AvatarCreate):
         from_attributes = True
 
 
+class BulkAvatarItem(BaseModel):
+    index: int                     # position in the request body
+    status: str                    # created | invalid
+    avatar: Optional[AvatarRead] = None
+    error: Optional[str] = None
+
+
+class BulkAvatarResponse(BaseModel):
+    created: int
+    failed: int
+    items: List[BulkAvatarItem]
+
+
 class ChatRequest(BaseModel):
     avatar_id: int
     message: str
@@ -56,6 +70,29 @@ class ChatResponse(BaseModel):
     reply: str
 
 
+class CancelResponse(BaseModel):
+    cancelled: bool
+    turn_id: Optional[int] = None
+
+
+class AvatarSummary(BaseModel):
+    id: int
+    name: str
+    image_url: Optional[str]
+    image_status: str
+
+
+class ChatInboxItem(BaseModel):
+    id: int
+    thread_id: str
+    created_at: datetime
+    avatar: AvatarSummary
+    last_message: Optional[str]  # preview, truncated to INBOX_PREVIEW_LEN chars
+    last_message_role: Optional[str]
+    last_message_at: Optional[datetime]
+    message_count: int
+
+
 class MessageRead(BaseModel):
     id: int
     chat_id: int
@@ -67,6 +104,15 @@ class MessageRead(BaseModel):
         from_attributes = True
 
 
+class CompactionReport(BaseModel):
+    chats_compacted: int
+    messages_archived: int
+    raw_bytes: int         # size of archived content before compression
+    stored_bytes: int      # size of the compressed blocks written
+    reclaimed_bytes: int   # drop in SQLite pages in use; freed pages go to the freelist for reuse
+    elapsed_sec: float
+
+
 # ─────────── ORM Tables (SQLModel) ───────────
 
 class User(SQLModel, table=True):
@@ -107,7 +153,7 @@ class ChatSession(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     thread_id: str = Field(index=True, description="OpenAI Thread ID")
 
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     avatar_id: int = Field(foreign_key="avatar.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -124,3 +170,16 @@ class Message(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     chat: Optional[ChatSession] = Relationship(back_populates="messages")
+
+
+class MessageArchive(SQLModel, table=True):
+    """Cold tier: a compressed block of consecutive messages of one chat."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chat_id: int = Field(foreign_key="chatsession.id", index=True)
+    first_message_id: int
+    last_message_id: int
+    message_count: int
+    codec: str = Field(default="zlib+json")
+    payload: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    raw_size: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,88 @@
+# static_files.py
+import os
+import re
+import hashlib
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+# `name.<16 hex>.ext`: the digest is part of the URL, so the content never changes
+HASHED_NAME = re.compile(r"\.([0-9a-f]{16})\.[A-Za-z0-9]+$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def hashed_filename(path_prefix: str, data: bytes, ext: str = "png") -> str:
+    return f"{path_prefix}.{content_digest(data)}.{ext}"
+
+
+class HashedStaticFiles(StaticFiles):
+    """
+    StaticFiles for content-hashed assets: immutable caching, a strong ETag
+    taken from the digest in the filename, and single-range requests.
+    Unhashed (legacy) files are served with `no-cache` so they revalidate.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        match = HASHED_NAME.search(os.fspath(full_path))
+        if not match:
+            response.headers["cache-control"] = REVALIDATE_CACHE
+            return response
+
+        response.headers["etag"] = f'"{match.group(1)}"'
+        response.headers["cache-control"] = IMMUTABLE_CACHE
+        response.headers["accept-ranges"] = "bytes"
+        request_headers = Headers(scope=scope)
+        if response.status_code == 200 and self.is_not_modified(response.headers, request_headers):
+            # re-check with the strong etag (the base class compared its own)
+            return Response(status_code=304, headers={
+                "etag": response.headers["etag"],
+                "cache-control": IMMUTABLE_CACHE,
+            })
+        if response.status_code == 200 and "range" in request_headers:
+            if_range = request_headers.get("if-range")
+            if if_range is None or if_range == response.headers["etag"]:
+                return self._range_response(full_path, stat_result.st_size, request_headers["range"], response)
+        return response
+
+    def _range_response(self, full_path, size: int, range_header: str, full: Response) -> Response:
+        match = RANGE.match(range_header.strip())
+        if not match or not any(match.groups()):
+            return full  # multi-range or malformed: serve the whole file
+        start_s, end_s = match.groups()
+        if start_s:
+            start = int(start_s)
+            if end_s and int(end_s) < start:
+                return full  # invalid range-spec: ignored per RFC 9110
+            if start >= size:
+                return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+            end = min(int(end_s), size - 1) if end_s else size - 1
+        else:
+            # suffix range: last N bytes
+            if int(end_s) == 0:
+                return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+            start = max(size - int(end_s), 0)
+            end = size - 1
+
+        with open(full_path, "rb") as fd:
+            fd.seek(start)
+            body = fd.read(end - start + 1)
+        return Response(
+            body,
+            status_code=206,
+            media_type=full.media_type,
+            headers={
+                "content-range": f"bytes {start}-{end}/{size}",
+                "accept-ranges": "bytes",
+                "etag": full.headers["etag"],
+                "cache-control": IMMUTABLE_CACHE,
+                "last-modified": full.headers["last-modified"],
+            },
+        )
@@ -1,25 +1,121 @@
 # store.py
-from typing import Optional
-from sqlmodel import Session
+from typing import Optional, List
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
 
-from models import ChatSession, Message
+from models import ChatSession, Message, MessageRead, MessageArchive, Avatar, AvatarSummary, ChatInboxItem
+from archive import read_archived_messages
+from tracing import span, traced
 
+INBOX_PREVIEW_LEN = 120
 
+
+@traced("store.create_chat_session")
 def create_chat_session(user_id: int, avatar_id: int, thread_id: str, session: Session) -> ChatSession:
     chat = ChatSession(user_id=user_id, avatar_id=avatar_id, thread_id=thread_id)
     session.add(chat)
-    session.commit()
+    with span("db.commit"):
+        session.commit()
     session.refresh(chat)
     return chat
 
 
+@traced("store.get_chat_session")
 def get_chat_session(chat_id: int, session: Session) -> Optional[ChatSession]:
     return session.get(ChatSession, chat_id)
 
 
+@traced("store.add_message")
 def add_message(session: Session, chat_id: int, role: str, content: str) -> Message:
     msg = Message(chat_id=chat_id, role=role, content=content)
     session.add(msg)
-    session.commit()
+    with span("db.commit"):
+        session.commit()
     session.refresh(msg)
     return msg
+
+
+@traced("store.list_chat_messages")
+def list_chat_messages(session: Session, chat_id: int) -> List[MessageRead]:
+    """All messages of a chat in order: archived blocks first, then the hot table."""
+    hot = session.exec(
+        select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at.asc())
+    ).all()
+    merged = read_archived_messages(session, chat_id)
+    merged.extend(MessageRead.model_validate(m) for m in hot)
+    return merged
+
+
+@traced("store.list_chat_inbox")
+def list_chat_inbox(session: Session, user_id: int, limit: int = 20, offset: int = 0) -> List[ChatInboxItem]:
+    """
+    One-query inbox: every chat of the user with its avatar summary, last
+    message preview and message count, most recently active first.
+
+    Per-chat stats are aggregated over the `message.chat_id` index, the last
+    message is fetched by primary key (max id == latest insert). Archived
+    counts come from the block headers; compaction keeps the latest message of
+    every chat hot, so previews never touch the cold tier.
+    """
+    user_chats = select(ChatSession.id).where(ChatSession.user_id == user_id)
+    stats = (
+        select(
+            Message.chat_id.label("chat_id"),
+            func.count(Message.id).label("message_count"),
+            func.max(Message.id).label("last_message_id"),
+        )
+        .where(Message.chat_id.in_(user_chats))
+        .group_by(Message.chat_id)
+        .subquery()
+    )
+    archived = (
+        select(
+            MessageArchive.chat_id.label("chat_id"),
+            func.sum(MessageArchive.message_count).label("message_count"),
+        )
+        .where(MessageArchive.chat_id.in_(user_chats))
+        .group_by(MessageArchive.chat_id)
+        .subquery()
+    )
+    last = aliased(Message)
+    last_activity = func.coalesce(last.created_at, ChatSession.created_at)
+
+    stmt = (
+        select(
+            ChatSession.id,
+            ChatSession.thread_id,
+            ChatSession.created_at,
+            Avatar.id,
+            Avatar.name,
+            Avatar.image_url,
+            Avatar.image_status,
+            func.substr(last.content, 1, INBOX_PREVIEW_LEN),
+            last.role,
+            last.created_at,
+            func.coalesce(stats.c.message_count, 0) + func.coalesce(archived.c.message_count, 0),
+        )
+        .join(Avatar, Avatar.id == ChatSession.avatar_id)
+        .outerjoin(stats, stats.c.chat_id == ChatSession.id)
+        .outerjoin(archived, archived.c.chat_id == ChatSession.id)
+        .outerjoin(last, last.id == stats.c.last_message_id)
+        .where(ChatSession.user_id == user_id)
+        .order_by(last_activity.desc(), ChatSession.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+
+    items = []
+    for (chat_id, thread_id, created_at, av_id, av_name, av_image_url, av_image_status,
+         preview, role, last_at, count) in session.exec(stmt).all():
+        items.append(ChatInboxItem(
+            id=chat_id,
+            thread_id=thread_id,
+            created_at=created_at,
+            avatar=AvatarSummary(id=av_id, name=av_name, image_url=av_image_url, image_status=av_image_status),
+            last_message=preview,
+            last_message_role=role,
+            last_message_at=last_at,
+            message_count=count,
+        ))
+    return items
@@ -0,0 +1,186 @@
+# streams.py
+import os
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from database import engine
+from lookup_cache import AvatarRef
+from store import add_message
+from assistant_api import assistant_chat_stream, cancel_run
+from tracing import span
+
+# How long a finished reply stays resumable after its last token
+STREAM_TTL_SEC = int(os.getenv("STREAM_TTL_SEC", "300"))
+# Appended to a partial reply that was stopped by the client
+CANCELLED_MARKER = " [cancelled]"
+# Appended to a partial reply cut short by a provider error
+ERROR_MARKER = " [error]"
+
+_DONE = object()
+
+
+class ReplyStream:
+    """
+    Server-side buffer of one assistant reply, keyed by (chat_id, turn_id).
+
+    Generation runs in its own task and outlives the websocket that started
+    it; any number of clients can follow the buffer from a token offset.
+    """
+
+    def __init__(self, chat_id: int, turn_id: int, thread_id: str):
+        self.chat_id = chat_id
+        self.turn_id = turn_id
+        self.thread_id = thread_id
+        self.run_id: Optional[str] = None
+        self.tokens: List[str] = []
+        self.generating = True
+        self.done = False
+        self.cancelled = False
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    async def _append(self, tok: str):
+        async with self._changed:
+            self.tokens.append(tok)
+            self._changed.notify_all()
+
+    async def _finish(self, error: Optional[str] = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def _cancel(self):
+        async with self._changed:
+            self.cancelled = True
+            self._changed.notify_all()
+
+    async def wait_done(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.done)
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[str]:
+        """
+        Yield buffered tokens from `offset`, then live ones until the reply ends.
+        Stops at once when the reply is cancelled.
+        """
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: self.done or self.cancelled or len(self.tokens) > offset
+                )
+                chunk = [] if self.cancelled else self.tokens[offset:]
+                finished = self.done or self.cancelled
+            for tok in chunk:
+                yield tok
+            offset += len(chunk)
+            if finished and not chunk:
+                break
+        if self.error and not self.cancelled:
+            raise RuntimeError(self.error)
+
+
+_streams: Dict[Tuple[int, int], ReplyStream] = {}
+_latest: Dict[int, ReplyStream] = {}
+
+
+def get_reply_stream(chat_id: int, turn_id: Optional[int] = None) -> Optional[ReplyStream]:
+    """Stream for a given turn, or the latest one of the chat if `turn_id` is None."""
+    if turn_id is None:
+        return _latest.get(chat_id)
+    return _streams.get((chat_id, turn_id))
+
+
+def _forget(stream: ReplyStream):
+    _streams.pop((stream.chat_id, stream.turn_id), None)
+    if _latest.get(stream.chat_id) is stream:
+        del _latest[stream.chat_id]
+
+
+def _save_reply(chat_id: int, content: str):
+    with Session(engine) as s:
+        add_message(s, chat_id, "assistant", content)
+
+
+def _on_run(stream: ReplyStream, run_id: str):
+    # called from the worker thread; a cancel may have arrived before the run existed
+    stream.run_id = run_id
+    if stream.cancelled:
+        try:
+            cancel_run(stream.thread_id, run_id)
+        except Exception as e:
+            print("Run cancel failed:", e)
+
+
+async def _produce(stream: ReplyStream, avatar: AvatarRef, user_msg: str):
+    with span("assistant.reply", chat_id=stream.chat_id, turn_id=stream.turn_id) as reply_span:
+        error = None
+        tokens = assistant_chat_stream(
+            stream.thread_id, avatar, user_msg, on_run=lambda run_id: _on_run(stream, run_id)
+        )
+        try:
+            # cancelled before the first step: never reach the provider
+            if not stream.cancelled:
+                while True:
+                    tok = await asyncio.to_thread(next, tokens, _DONE)
+                    if tok is _DONE:
+                        break
+                    # after a cancel keep draining, without buffering, until the
+                    # provider ends the run: the OpenAI thread must be idle before
+                    # the next turn can post to it
+                    if not stream.cancelled:
+                        await stream._append(tok)
+            tokens.close()
+            stream.generating = False
+            reply = "".join(stream.tokens)
+            if stream.cancelled:
+                reply_span.set(cancelled=True)
+                reply += CANCELLED_MARKER
+            await asyncio.to_thread(_save_reply, stream.chat_id, reply)
+        except Exception as e:
+            error = str(e)
+            reply_span.error = error
+            print("Assistant stream failed:", e)
+            # the user turn still gets an assistant row, with whatever was streamed
+            marker = CANCELLED_MARKER if stream.cancelled else ERROR_MARKER
+            await asyncio.to_thread(_save_reply, stream.chat_id, "".join(stream.tokens) + marker)
+        finally:
+            stream.generating = False
+            reply_span.set(tokens=len(stream.tokens))
+            await stream._finish(error)
+            asyncio.get_running_loop().call_later(STREAM_TTL_SEC, _forget, stream)
+
+
+def start_reply(chat_id: int, turn_id: int, thread_id: str, avatar: AvatarRef, user_msg: str) -> ReplyStream:
+    """
+    Launch generation for one turn in the background. The reply is saved with
+    `add_message` when it finishes, whether or not a client is still attached.
+    """
+    stream = ReplyStream(chat_id, turn_id, thread_id)
+    stream.task = asyncio.create_task(_produce(stream, avatar, user_msg))
+    _streams[(chat_id, turn_id)] = stream
+    _latest[chat_id] = stream
+    return stream
+
+
+async def cancel_reply(stream: ReplyStream) -> bool:
+    """
+    Stop an in-flight reply. Followers stop relaying immediately; the provider
+    run is cancelled and the call returns once it has ended and the partial
+    reply is saved with `CANCELLED_MARKER`, so the chat is free for the next
+    turn. Returns False if the reply had already finished.
+    """
+    if not stream.generating or stream.cancelled:
+        return False
+    await stream._cancel()
+    # if the run does not exist yet, _on_run cancels it as soon as it is created
+    if stream.run_id:
+        try:
+            await asyncio.to_thread(cancel_run, stream.thread_id, stream.run_id)
+        except Exception as e:
+            print("Run cancel failed:", e)
+    await stream.wait_done()
+    return True
@@ -0,0 +1,164 @@
+# tracing.py
+import os
+import json
+import time
+import queue
+import random
+import secrets
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import requests
+
+# Export targets: JSON lines to TRACE_FILE and/or POSTed batches to TRACE_COLLECTOR_URL.
+# With neither set, tracing is off.
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_FLUSH_SEC = float(os.getenv("TRACE_FLUSH_SEC", "1.0"))
+
+ENABLED = bool(TRACE_FILE or TRACE_COLLECTOR_URL)
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_finished: "queue.Queue[dict]" = queue.Queue(maxsize=10000)
+
+
+class Span:
+    """One timed operation. Sampling is decided at the trace root and inherited."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.sampled = parent.sampled if parent else ENABLED and random.random() < TRACE_SAMPLE_RATE
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self._start_wall = time.time()
+        self._start = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._start) * 1000, 3)
+
+    def end(self):
+        if not self.sampled:
+            return
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self._start_wall,
+            "duration_ms": self.elapsed_ms(),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+        try:
+            _finished.put_nowait(record)
+        except queue.Full:
+            pass  # drop rather than block the request path
+
+
+def start_span(name: str, **attrs) -> Span:
+    """
+    Start a child of the current span without making it current. For spans
+    that outlive one call frame (e.g. across generator yields); call `.end()`.
+    """
+    return Span(name, _current.get(), **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    s = Span(name, _current.get(), **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        s.end()
+
+
+def traced(name: str):
+    """Decorator form of `span`."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def instrument_engine(engine):
+    """Record every SQL statement executed on `engine` as a `db.query` span."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        # only inside a sampled trace; stray queries are not worth a root span
+        s = Span("db.query", parent, statement=statement[:200]) if parent and parent.sampled else None
+        conn.info.setdefault("trace_spans", []).append(s)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            s = spans.pop()
+            if s:
+                s.end()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        # a failed statement never reaches after_cursor_execute
+        spans = ctx.connection.info.get("trace_spans") if ctx.connection is not None else None
+        if spans:
+            s = spans.pop()
+            if s:
+                s.error = repr(ctx.original_exception)
+                s.end()
+
+
+def _drain() -> list:
+    batch = []
+    while True:
+        try:
+            batch.append(_finished.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+def _export(batch: list):
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a", encoding="utf-8") as fd:
+            for record in batch:
+                fd.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if TRACE_COLLECTOR_URL:
+        requests.post(TRACE_COLLECTOR_URL, json={"spans": batch}, timeout=5)
+
+
+def _export_loop():
+    while True:
+        time.sleep(TRACE_FLUSH_SEC)
+        batch = _drain()
+        if not batch:
+            continue
+        try:
+            _export(batch)
+        except Exception as e:
+            print("Trace export failed:", e)
+
+
+def start_exporter():
+    if ENABLED:
+        threading.Thread(target=_export_loop, daemon=True).start()
+        print(f"Tracing enabled (sample rate {TRACE_SAMPLE_RATE})")